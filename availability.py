@@ -6,6 +6,7 @@ Usage:
     python availability.py -d 2026-01-22        # Check specific date
     python availability.py -n 5                 # Check next 5 weekdays
     python availability.py -n 10 --weekends     # Include weekends
+    python availability.py --no-cache           # Refetch instead of using cached responses
 
 Config file (availability_calendars.json):
 {
@@ -18,21 +19,37 @@ Config file (availability_calendars.json):
 """
 
 import argparse
+import bisect
+import heapq
 import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from functools import lru_cache
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+from googleapiclient.http import build_http
 
 DIR = Path(__file__).parent
 CONFIG_FILE = DIR / "accounts.json"
 CALENDARS_FILE = DIR / "availability_calendars.json"
 TIMEZONE = "America/Chicago"
+# Max calendars per freebusy request body (the API rejects larger batches)
+FREEBUSY_BATCH_SIZE = 50
 
+# Freebusy responses are cached briefly so repeated runs skip the API
+CACHE_FILE = DIR / ".freebusy_cache.sqlite"
+CACHE_TTL = 60              # seconds, for windows that reach into the future
+CACHE_TTL_PAST = 60 * 60    # seconds, for windows entirely in the past
 
+
+@lru_cache(maxsize=None)
 def load_accounts():
     """Load accounts configuration."""
     config = json.loads(CONFIG_FILE.read_text())
@@ -40,6 +57,7 @@ def load_accounts():
             for k, v in config.get("accounts", {}).items()}
 
 
+@lru_cache(maxsize=None)
 def load_calendar_config():
     """Load calendar configuration for availability checking."""
     if not CALENDARS_FILE.exists():
@@ -47,6 +65,10 @@ def load_calendar_config():
     return json.loads(CALENDARS_FILE.read_text())
 
 
+# Loaded credentials, keyed by account
+_credentials = {}
+
+
 def get_credentials(account: str):
     """Get credentials for specified account."""
     accounts = load_accounts()
@@ -54,10 +76,13 @@ def get_credentials(account: str):
         raise ValueError(f"Unknown account: {account}")
 
     token_file = DIR / accounts[account]["token"]
-    if not token_file.exists():
-        raise ValueError(f"No token file for account: {account}. Run calendar_mcp_server first.")
+    creds = _credentials.get(account)
+    if creds is None:
+        if not token_file.exists():
+            raise ValueError(f"No token file for account: {account}. Run calendar_mcp_server first.")
+        creds = Credentials.from_authorized_user_file(str(token_file))
+        _credentials[account] = creds
 
-    creds = Credentials.from_authorized_user_file(str(token_file))
     if creds and creds.expired and creds.refresh_token:
         creds.refresh(Request())
         token_file.write_text(creds.to_json())
@@ -65,51 +90,141 @@ def get_credentials(account: str):
     return creds
 
 
-def get_busy_times(calendars: list, start: datetime, end: datetime) -> list:
-    """Query freebusy API for all calendars and return merged busy periods."""
-    # Group calendars by account
-    by_account = {}
-    for cal in calendars:
-        account = cal.get("account")
-        if account not in by_account:
-            by_account[account] = []
-        by_account[account].append(cal["id"])
+@lru_cache(maxsize=None)
+def get_calendar_service():
+    """Get the Calendar API client shared by all accounts.
 
-    all_busy = []
+    Requests are authorized per account at execute time, so the discovery
+    document is only parsed once.
+    """
+    return build('calendar', 'v3', http=build_http(), cache_discovery=False, static_discovery=True)
 
-    for account, cal_ids in by_account.items():
-        creds = get_credentials(account)
-        service = build('calendar', 'v3', credentials=creds)
 
+def parse_time(value: str) -> datetime:
+    """Parse an RFC 3339 timestamp from the API."""
+    # Responses use the requested timeZone's offset; only UTC ones end in "Z"
+    if value[-1] == "Z":
+        value = value[:-1] + "+00:00"
+    return datetime.fromisoformat(value)
+
+
+def _query_account(account: str, cal_ids: list, start: datetime, end: datetime) -> dict:
+    """Query freebusy for one account's calendars.
+
+    Returns the API's per-calendar results, keyed by calendar ID.
+    """
+    service = get_calendar_service()
+    http = AuthorizedHttp(get_credentials(account), http=build_http())
+
+    calendars = {}
+    for i in range(0, len(cal_ids), FREEBUSY_BATCH_SIZE):
         body = {
             "timeMin": start.isoformat(),
             "timeMax": end.isoformat(),
             "timeZone": TIMEZONE,
-            "items": [{"id": cal_id} for cal_id in cal_ids]
+            "items": [{"id": cal_id} for cal_id in cal_ids[i:i + FREEBUSY_BATCH_SIZE]]
         }
 
-        result = service.freebusy().query(body=body).execute()
+        result = service.freebusy().query(body=body).execute(http=http)
+        calendars.update(result.get("calendars", {}))
+
+    return calendars
+
+
+def open_cache():
+    """Open the freebusy response cache, creating it if needed.
+
+    Responses too old to be reused for any window are dropped.
+    """
+    conn = sqlite3.connect(str(CACHE_FILE))
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS freebusy (
+        account TEXT,
+        cal_id TEXT,
+        tmin TEXT,
+        tmax TEXT,
+        fetched_at REAL,
+        payload BLOB,
+        PRIMARY KEY (account, cal_id, tmin, tmax)
+    )
+    """)
+    with conn:
+        conn.execute("DELETE FROM freebusy WHERE fetched_at <= ?", (time.time() - CACHE_TTL_PAST,))
+    return conn
+
+
+def get_busy_times(calendars: list, start: datetime, end: datetime, use_cache: bool = True) -> list:
+    """Query freebusy API for all calendars and return merged busy periods.
+
+    Periods are sorted and converted to the local timezone. Responses younger
+    than the cache TTL are reused unless use_cache is False; fresh responses
+    are cached either way.
+    """
+    tmin, tmax = start.isoformat(), end.isoformat()
+    ttl = CACHE_TTL_PAST if end <= datetime.now(end.tzinfo) else CACHE_TTL
+    cache = open_cache()
+
+    # Busy lists per (account, calendar); calendars missing from the cache
+    # are grouped by account for querying
+    busy_lists = {}
+    by_account = {}
+    for cal in calendars:
+        account = cal.get("account")
+        if use_cache:
+            row = cache.execute(
+                "SELECT payload FROM freebusy WHERE account = ? AND cal_id = ? AND tmin = ? AND tmax = ? "
+                "AND fetched_at > ?",
+                (account, cal["id"], tmin, tmax, time.time() - ttl)
+            ).fetchone()
+            if row:
+                busy_lists[(account, cal["id"])] = json.loads(row[0])
+                continue
+        if account not in by_account:
+            by_account[account] = []
+        by_account[account].append(cal["id"])
 
-        for cal_id, cal_data in result.get("calendars", {}).items():
-            for busy in cal_data.get("busy", []):
-                busy_start = datetime.fromisoformat(busy["start"].replace("Z", "+00:00"))
-                busy_end = datetime.fromisoformat(busy["end"].replace("Z", "+00:00"))
-                all_busy.append((busy_start, busy_end))
+    if by_account:
+        # Accounts are queried concurrently; each query is a blocking HTTP round-trip
+        with ThreadPoolExecutor(max_workers=len(by_account)) as executor:
+            futures = {executor.submit(_query_account, account, cal_ids, start, end): account
+                       for account, cal_ids in by_account.items()}
+            for future in as_completed(futures):
+                account = futures[future]
+                for cal_id, cal_data in future.result().items():
+                    busy_lists[(account, cal_id)] = cal_data.get("busy", [])
+                    # Don't cache calendars the account couldn't read
+                    if "errors" not in cal_data:
+                        cache.execute(
+                            "INSERT OR REPLACE INTO freebusy VALUES (?, ?, ?, ?, ?, ?)",
+                            (account, cal_id, tmin, tmax, time.time(), json.dumps(cal_data.get("busy", [])))
+                        )
+
+    cache.commit()
+    cache.close()
+
+    per_calendar = [[(parse_time(busy["start"]), parse_time(busy["end"])) for busy in busy_list]
+                    for busy_list in busy_lists.values()]
+
+    # Each calendar's list is already sorted, so a k-way merge keeps the order
+    merged_stream = heapq.merge(*per_calendar, key=lambda x: x[0])
+    merged = merge_busy_periods(merged_stream, pre_sorted=True)
 
-    return merge_busy_periods(all_busy)
+    tz = ZoneInfo(TIMEZONE)
+    return [(busy_start.astimezone(tz), busy_end.astimezone(tz)) for busy_start, busy_end in merged]
 
 
-def merge_busy_periods(periods: list) -> list:
-    """Merge overlapping busy periods."""
-    if not periods:
-        return []
+def merge_busy_periods(periods, pre_sorted: bool = False) -> list:
+    """Merge overlapping busy periods.
 
-    sorted_periods = sorted(periods, key=lambda x: x[0])
-    merged = [sorted_periods[0]]
+    Set pre_sorted if periods (any iterable) are already ordered by start time.
+    """
+    if not pre_sorted:
+        periods = sorted(periods, key=lambda x: x[0])
 
-    for start, end in sorted_periods[1:]:
-        last_start, last_end = merged[-1]
-        if start <= last_end:
+    merged = []
+    for start, end in periods:
+        if merged and start <= merged[-1][1]:
+            last_start, last_end = merged[-1]
             merged[-1] = (last_start, max(last_end, end))
         else:
             merged.append((start, end))
@@ -118,21 +233,24 @@ def merge_busy_periods(periods: list) -> list:
 
 
 def get_free_slots(busy_periods: list, day_start: datetime, day_end: datetime) -> list:
-    """Calculate free slots given busy periods and work hours."""
-    tz = ZoneInfo(TIMEZONE)
+    """Calculate free slots given busy periods and work hours.
+
+    busy_periods must be merged and sorted, as returned by get_busy_times.
+    """
     free = []
     current = day_start
 
-    for busy_start, busy_end in busy_periods:
-        busy_start_local = busy_start.astimezone(tz)
-        busy_end_local = busy_end.astimezone(tz)
+    # Only periods ending after day_start and starting before day_end overlap
+    # the day; merged periods don't overlap, so their ends are sorted as well
+    lo = bisect.bisect_right(busy_periods, day_start, key=lambda x: x[1])
+    hi = bisect.bisect_left(busy_periods, day_end, lo, key=lambda x: x[0])
 
-        # Clamp to work hours
-        if busy_end_local <= day_start or busy_start_local >= day_end:
-            continue
+    for i in range(lo, hi):
+        busy_start, busy_end = busy_periods[i]
 
-        busy_start_clamped = max(busy_start_local, day_start)
-        busy_end_clamped = min(busy_end_local, day_end)
+        # Clamp to work hours
+        busy_start_clamped = max(busy_start, day_start)
+        busy_end_clamped = min(busy_end, day_end)
 
         if current < busy_start_clamped:
             free.append((current, busy_start_clamped))
@@ -146,8 +264,9 @@ def get_free_slots(busy_periods: list, day_start: datetime, day_end: datetime) -
 
 
 def format_time(dt: datetime) -> str:
-    """Format datetime for display."""
-    return dt.strftime("%-I:%M %p")
+    """Format datetime for display (e.g. "9:05 AM")."""
+    hour = dt.hour
+    return f"{hour % 12 or 12}:{dt.minute:02d} {'AM' if hour < 12 else 'PM'}"
 
 
 def format_duration(start: datetime, end: datetime) -> str:
@@ -172,6 +291,7 @@ def main():
     parser.add_argument("-d", "--date", help="Start date (YYYY-MM-DD), default: today")
     parser.add_argument("-n", "--days", type=int, default=1, help="Number of days to check (default: 1)")
     parser.add_argument("--weekends", action="store_true", help="Include weekends (excluded by default)")
+    parser.add_argument("--no-cache", action="store_true", help="Ignore cached freebusy responses")
     args = parser.parse_args()
 
     config = load_calendar_config()
@@ -193,10 +313,10 @@ def main():
         print("(excluding weekends)")
     print()
 
-    days_checked = 0
+    dates = []
     day_offset = 0
 
-    while days_checked < args.days:
+    while len(dates) < args.days:
         current_date = start_date + timedelta(days=day_offset)
         day_offset += 1
 
@@ -204,25 +324,33 @@ def main():
         if not args.weekends and is_weekend(current_date):
             continue
 
-        days_checked += 1
+        dates.append(current_date)
 
-        # For today, start from current time (rounded up to next 15 min)
-        if current_date == now.date():
-            # Round up to next 15-minute mark
-            minutes = now.minute
-            round_up = 15 - (minutes % 15) if minutes % 15 != 0 else 0
-            earliest = now + timedelta(minutes=round_up)
-            earliest = earliest.replace(second=0, microsecond=0)
-
-            work_start = datetime(current_date.year, current_date.month, current_date.day,
-                                 work_start_hour, 0, tzinfo=tz)
-            day_start = max(earliest, work_start)
-        else:
-            day_start = datetime(current_date.year, current_date.month, current_date.day,
-                                work_start_hour, 0, tzinfo=tz)
+    if not dates:
+        return
+
+    # Query busy times for the whole range at once
+    query_start = datetime(dates[0].year, dates[0].month, dates[0].day, 0, 0, tzinfo=tz)
+    query_end = query_start + timedelta(days=(dates[-1] - dates[0]).days + 1)
+    busy = get_busy_times(calendars, query_start, query_end, use_cache=not args.no_cache)
+
+    # For today, start from current time (rounded up to next 15 min)
+    minutes = now.minute
+    round_up = 15 - (minutes % 15) if minutes % 15 != 0 else 0
+    earliest = now + timedelta(minutes=round_up)
+    earliest = earliest.replace(second=0, microsecond=0)
 
-        day_end = datetime(current_date.year, current_date.month, current_date.day,
-                          work_end_hour, 0, tzinfo=tz)
+    work_start_offset = timedelta(hours=work_start_hour)
+    work_end_offset = timedelta(hours=work_end_hour)
+
+    for current_date in dates:
+        # Adding to an aware datetime keeps wall-clock hours across DST changes
+        midnight = query_start + timedelta(days=(current_date - dates[0]).days)
+        day_start = midnight + work_start_offset
+        day_end = midnight + work_end_offset
+
+        if current_date == now.date():
+            day_start = max(earliest, day_start)
 
         # Skip if day is already over
         if day_start >= day_end:
@@ -231,11 +359,6 @@ def main():
             print()
             continue
 
-        # Query full day for busy times
-        query_start = datetime(current_date.year, current_date.month, current_date.day, 0, 0, tzinfo=tz)
-        query_end = query_start + timedelta(days=1)
-
-        busy = get_busy_times(calendars, query_start, query_end)
         free_slots = get_free_slots(busy, day_start, day_end)
 
         day_name = current_date.strftime("%A, %B %-d, %Y")
@@ -2,20 +2,95 @@
 """Browser Agent MCP Server - Execute browser tasks using OpenAI's CUA model."""
 
 import os
-import base64
 import asyncio
+import itertools
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import List, Dict
 
 from dotenv import load_dotenv
 import httpx
+import orjson
 
 # Load .env from same directory as this script
 load_dotenv(Path(__file__).parent / ".env")
-from playwright.async_api import async_playwright, Browser, Page
+from playwright.async_api import async_playwright, Browser, BrowserContext, CDPSession, Page
 from mcp.server.fastmcp import FastMCP
 
-mcp = FastMCP("browser-agent")
+# Shared client for OpenAI requests so connections are reused across CUA steps
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(120),
+            limits=httpx.Limits(max_keepalive_connections=4),
+        )
+    return _client
+
+
+# Browser window size, also declared to the model as the display size
+DISPLAY_WIDTH = 1024
+DISPLAY_HEIGHT = 768
+
+CHROMIUM_ARGS = [
+    f"--window-size={DISPLAY_WIDTH},{DISPLAY_HEIGHT}",
+    "--disable-extensions",
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-background-networking",
+    "--disable-features=Translate,BackForwardCache",
+]
+
+# Chromium instances kept running between tasks, keyed by headless flag
+_playwright = None
+_browsers: dict[bool, Browser] = {}
+_browser_lock = asyncio.Lock()
+
+
+async def get_browser(headless: bool) -> Browser:
+    """Get a running Chromium instance, launching it on first use.
+
+    Keeping the browser alive means only the first task pays Chromium's cold
+    start; every task still gets its own fresh context.
+    """
+    global _playwright
+    async with _browser_lock:
+        browser = _browsers.get(headless)
+        if browser is None or not browser.is_connected():
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+            browser = await _playwright.chromium.launch(headless=headless, args=CHROMIUM_ARGS)
+            _browsers[headless] = browser
+        return browser
+
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    """Close the shared HTTP client and browsers when the server shuts down."""
+    global _client, _playwright
+    try:
+        yield
+    finally:
+        if _client is not None:
+            await _client.aclose()
+            _client = None
+        for browser in _browsers.values():
+            await browser.close()
+        _browsers.clear()
+        if _playwright is not None:
+            await _playwright.stop()
+            _playwright = None
+
+
+mcp = FastMCP("browser-agent", lifespan=lifespan)
+
+# Screenshot encoding sent to the model; set to "png" for lossless debugging
+SCREENSHOT_FORMAT = os.getenv("BROWSER_AGENT_SCREENSHOT_FORMAT", "jpeg")
+SCREENSHOT_QUALITY = 70
 
 # Key mapping for CUA
 CUA_KEY_TO_PLAYWRIGHT_KEY = {
@@ -25,6 +100,7 @@ CUA_KEY_TO_PLAYWRIGHT_KEY = {
     "pageup": "PageUp", "pagedown": "PageDown", "shift": "Shift", "ctrl": "Control",
     "alt": "Alt", "cmd": "Meta", "win": "Meta", "super": "Meta", "option": "Alt",
 }
+_map_cua_key = CUA_KEY_TO_PLAYWRIGHT_KEY.get
 
 
 async def create_response(**kwargs):
@@ -34,54 +110,48 @@ async def create_response(**kwargs):
         "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
         "Content-Type": "application/json"
     }
-    async with httpx.AsyncClient(timeout=120) as client:
-        response = await client.post(url, headers=headers, json=kwargs)
-        if response.status_code != 200:
-            raise Exception(f"OpenAI API error: {response.status_code} {response.text}")
-        return response.json()
+    # Request bodies carry base64 screenshots; orjson encodes them much faster
+    response = await get_client().post(url, headers=headers, content=orjson.dumps(kwargs))
+    if response.status_code != 200:
+        raise Exception(f"OpenAI API error: {response.status_code} {response.text}")
+    return orjson.loads(response.content)
 
 
 class AsyncPlaywrightBrowser:
     """Async Playwright browser wrapper for CUA."""
 
-    def __init__(self, headless: bool = False):
+    def __init__(self, headless: bool = False, screenshot_format: str = SCREENSHOT_FORMAT):
         self.headless = headless
-        self._playwright = None
-        self._browser: Browser | None = None
+        self.screenshot_format = screenshot_format
+        self._context: BrowserContext | None = None
         self._page: Page | None = None
-        self.width = 1024
-        self.height = 768
+        # CDP session used for screenshots, and the page it is attached to
+        self._cdp: CDPSession | None = None
+        self._cdp_page: Page | None = None
+        self.width = DISPLAY_WIDTH
+        self.height = DISPLAY_HEIGHT
 
     async def __aenter__(self):
-        self._playwright = await async_playwright().start()
-        launch_args = [
-            f"--window-size={self.width},{self.height}",
-            "--disable-extensions",
-        ]
-        self._browser = await self._playwright.chromium.launch(
-            headless=self.headless,
-            args=launch_args,
-        )
-        context = await self._browser.new_context()
-        context.on("page", self._handle_new_page)
-        self._page = await context.new_page()
+        browser = await get_browser(self.headless)
+        self._context = await browser.new_context()
+        self._context.on("page", self._handle_new_page)
+        self._page = await self._context.new_page()
         await self._page.set_viewport_size({"width": self.width, "height": self.height})
         self._page.on("close", self._handle_page_close)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self._browser:
-            await self._browser.close()
-        if self._playwright:
-            await self._playwright.stop()
+        # The browser itself stays up for the next task
+        if self._context:
+            await self._context.close()
 
     def _handle_new_page(self, page: Page):
         self._page = page
         page.on("close", self._handle_page_close)
 
     def _handle_page_close(self, page: Page):
-        if self._page == page and self._browser.contexts[0].pages:
-            self._page = self._browser.contexts[0].pages[-1]
+        if self._page == page and self._context.pages:
+            self._page = self._context.pages[-1]
 
     def get_dimensions(self):
         return (self.width, self.height)
@@ -89,9 +159,21 @@ class AsyncPlaywrightBrowser:
     def get_current_url(self) -> str:
         return self._page.url
 
+    @property
+    def screenshot_mime_type(self) -> str:
+        return f"image/{self.screenshot_format}"
+
     async def screenshot(self) -> str:
-        png_bytes = await self._page.screenshot(full_page=False)
-        return base64.b64encode(png_bytes).decode("utf-8")
+        # Capture through a reused CDP session, which returns base64 directly;
+        # a new session is only opened after the active page changes
+        if self._cdp_page is not self._page:
+            self._cdp = await self._page.context.new_cdp_session(self._page)
+            self._cdp_page = self._page
+        params = {"format": self.screenshot_format}
+        if self.screenshot_format == "jpeg":
+            params["quality"] = SCREENSHOT_QUALITY
+        result = await self._cdp.send("Page.captureScreenshot", params)
+        return result["data"]
 
     async def click(self, x: int, y: int, button: str = "left"):
         if button == "back":
@@ -120,11 +202,15 @@ class AsyncPlaywrightBrowser:
         await self._page.mouse.move(x, y)
 
     async def keypress(self, keys: List[str]):
-        mapped = [CUA_KEY_TO_PLAYWRIGHT_KEY.get(k.lower(), k) for k in keys]
-        for key in mapped:
-            await self._page.keyboard.down(key)
-        for key in reversed(mapped):
-            await self._page.keyboard.up(key)
+        mapped = [_map_cua_key(k.lower(), k) for k in keys]
+        if "+" in mapped:
+            # "+" is Playwright's chord separator, so hold the keys one by one
+            for key in mapped:
+                await self._page.keyboard.down(key)
+            for key in reversed(mapped):
+                await self._page.keyboard.up(key)
+        else:
+            await self._page.keyboard.press("+".join(mapped))
 
     async def drag(self, path: List[Dict[str, int]]):
         if not path:
@@ -139,6 +225,29 @@ class AsyncPlaywrightBrowser:
         await self._page.goto(url)
 
 
+# Computer actions that don't change the page
+OBSERVATION_ACTIONS = {"screenshot", "wait"}
+
+
+def is_observation(item: dict) -> bool:
+    """Check if an output item is a computer call that only observes the page."""
+    return item["type"] == "computer_call" and item["action"]["type"] in OBSERVATION_ACTIONS
+
+
+def computer_call_output(item: dict, screenshot_base64: str, mime_type: str, current_url: str) -> dict:
+    """Build the computer_call_output answering a computer call."""
+    return {
+        "type": "computer_call_output",
+        "call_id": item["call_id"],
+        "acknowledged_safety_checks": item.get("pending_safety_checks", []),
+        "output": {
+            "type": "input_image",
+            "image_url": f"data:{mime_type};base64,{screenshot_base64}",
+            "current_url": current_url,
+        },
+    }
+
+
 async def run_browser_task(task: str, start_url: str = "https://google.com", headless: bool = False, max_steps: int = 50) -> str:
     """Run a browser task using OpenAI's CUA model."""
     log = []
@@ -155,7 +264,10 @@ async def run_browser_task(task: str, start_url: str = "https://google.com", hea
             "environment": "browser",
         }]
 
+        # Only new inputs are sent each step; earlier turns (and their
+        # screenshots) are referenced through previous_response_id
         items = [{"role": "user", "content": task}]
+        previous_response = {}
         step = 0
 
         while step < max_steps:
@@ -165,45 +277,55 @@ async def run_browser_task(task: str, start_url: str = "https://google.com", hea
                 input=items,
                 tools=tools,
                 truncation="auto",
+                **previous_response,
             )
 
             if "output" not in response:
                 log.append(f"Error: No output from model - {response}")
                 break
 
-            items += response["output"]
-
-            for item in response["output"]:
-                if item["type"] == "message":
-                    text = item["content"][0]["text"]
-                    log.append(f"Agent: {text}")
-
-                elif item["type"] == "computer_call":
-                    action = item["action"]
-                    action_type = action["type"]
-                    action_args = {k: v for k, v in action.items() if k != "type"}
-                    log.append(f"Action: {action_type}({action_args})")
+            previous_response = {"previous_response_id": response["id"]}
+            items = []
 
-                    # Execute the action
-                    method = getattr(browser, action_type)
-                    await method(**action_args)
+            for observing, group in itertools.groupby(response["output"], key=is_observation):
+                if observing:
+                    # Observations don't change the page: run the waits in order, so
+                    # the page gets their full total, then answer them all with one screenshot
+                    calls = list(group)
+                    for item in calls:
+                        action_args = {k: v for k, v in item["action"].items() if k != "type"}
+                        log.append(f"Action: {item['action']['type']}({action_args})")
+                        if item["action"]["type"] == "wait":
+                            await browser.wait(**action_args)
 
-                    # Get screenshot and add to items
                     screenshot_base64 = await browser.screenshot()
-                    call_output = {
-                        "type": "computer_call_output",
-                        "call_id": item["call_id"],
-                        "acknowledged_safety_checks": item.get("pending_safety_checks", []),
-                        "output": {
-                            "type": "input_image",
-                            "image_url": f"data:image/png;base64,{screenshot_base64}",
-                            "current_url": browser.get_current_url(),
-                        },
-                    }
-                    items.append(call_output)
-
-            # Check if we got a final assistant message
-            if items[-1].get("role") == "assistant":
+                    current_url = browser.get_current_url()
+                    items += [computer_call_output(item, screenshot_base64, browser.screenshot_mime_type, current_url)
+                              for item in calls]
+                    continue
+
+                for item in group:
+                    if item["type"] == "message":
+                        text = item["content"][0]["text"]
+                        log.append(f"Agent: {text}")
+
+                    elif item["type"] == "computer_call":
+                        action = item["action"]
+                        action_type = action["type"]
+                        action_args = {k: v for k, v in action.items() if k != "type"}
+                        log.append(f"Action: {action_type}({action_args})")
+
+                        # Execute the action
+                        method = getattr(browser, action_type)
+                        await method(**action_args)
+
+                        # Get screenshot and add to items
+                        screenshot_base64 = await browser.screenshot()
+                        current_url = browser.get_current_url()
+                        items.append(computer_call_output(item, screenshot_base64, browser.screenshot_mime_type, current_url))
+
+            # No actions to report back means the model is done
+            if not items:
                 break
 
         final_url = browser.get_current_url()
@@ -6,15 +6,15 @@ If the laptop's timezone differs from home, create_event will require jetlag=Tru
 to prevent accidental scheduling mistakes when traveling.
 """
 
+import asyncio
 import json
+import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.http import build_http
 from mcp.server.fastmcp import FastMCP
 
 SCOPES = ['https://www.googleapis.com/auth/calendar', 'https://www.googleapis.com/auth/userinfo.email', 'openid']
@@ -22,6 +22,8 @@ SCOPES = ['https://www.googleapis.com/auth/calendar', 'https://www.googleapis.co
 DIR = Path(__file__).parent
 CREDENTIALS_FILE = list(DIR.glob("client_secret_*.json"))[0]
 CONFIG_FILE = DIR / "accounts.json"
+# Calendar accepts at most 50 requests per batch
+BATCH_SIZE = 50
 
 
 def load_config():
@@ -47,28 +49,83 @@ TIMEZONE_OFFSETS = {
 }
 
 
-def is_in_home_timezone() -> bool:
-    """Check if the system is currently in the configured home timezone."""
-    offset_hours = -time.timezone // 3600
+def get_utc_offset_hours() -> int:
+    """Get the system's current UTC offset in hours."""
     if time.daylight and time.localtime().tm_isdst:
-        offset_hours = -time.altzone // 3600
+        return -time.altzone // 3600
+    return -time.timezone // 3600
+
+
+def is_in_home_timezone(offset_hours: int) -> bool:
+    """Check if the given UTC offset matches the configured home timezone."""
     expected_offsets = TIMEZONE_OFFSETS.get(HOME_TIMEZONE, (-6, -5))
     return offset_hours in expected_offsets
 
+
+# (monotonic time, UTC offset, in home timezone) of the last timezone check
+_timezone_check = (float('-inf'), 0, False)
+TIMEZONE_CHECK_TTL = 3600
+
+
+def check_home_timezone() -> tuple[int, bool]:
+    """Get the system's UTC offset and whether it matches the home timezone.
+
+    The result is cached for an hour; it only changes across DST transitions.
+    """
+    global _timezone_check
+    checked_at, offset_hours, at_home = _timezone_check
+    now = time.monotonic()
+    if now - checked_at > TIMEZONE_CHECK_TTL:
+        offset_hours = get_utc_offset_hours()
+        at_home = is_in_home_timezone(offset_hours)
+        _timezone_check = (now, offset_hours, at_home)
+    return offset_hours, at_home
+
 mcp = FastMCP("calendar")
 
 
+# Authenticated (credentials, service) pairs, keyed by account
+_services = {}
+_services_lock = threading.Lock()
+
+# Cached credentials this close to expiry are refreshed in the background
+REFRESH_AHEAD = timedelta(minutes=5)
+# Accounts with a background refresh in flight
+_refreshing = set()
+
+# One HTTP connection per thread, shared by every account and service; kept
+# alive between requests (httplib2 connections are not thread-safe)
+_thread_local = threading.local()
+
+
 def get_calendar_service(account: str = ""):
-    """Get authenticated Calendar service for specified account."""
+    """Get authenticated Calendar service for specified account.
+
+    Services are cached per account; expired credentials are refreshed in place
+    and the service is only rebuilt after a new OAuth flow.
+    """
     account = account or DEFAULT_ACCOUNT
     if account not in ACCOUNTS:
         raise ValueError(f"Unknown account: {account}. Valid accounts: {list(ACCOUNTS.keys())}")
 
+    with _services_lock:
+        return _get_calendar_service(account)
+
+
+def _get_calendar_service(account: str):
+    # Only needed to authenticate and build the service, and slow to import,
+    # so they are loaded on first use rather than at server start
+    from google.auth import jwt
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+
     account_info = ACCOUNTS[account]
     token_file = DIR / account_info["token"]
     expected_email = account_info["email"]
-    creds = None
-    if token_file.exists():
+    creds, service = _services.get(account, (None, None))
+    if creds is None and token_file.exists():
         creds = Credentials.from_authorized_user_file(str(token_file), SCOPES)
 
     if not creds or not creds.valid:
@@ -77,29 +134,128 @@ def get_calendar_service(account: str = ""):
         else:
             flow = InstalledAppFlow.from_client_secrets_file(str(CREDENTIALS_FILE), SCOPES)
             creds = flow.run_local_server(port=0)
-            # Verify the authenticated email matches expected
-            oauth2_service = build('oauth2', 'v2', credentials=creds)
-            user_info = oauth2_service.userinfo().get().execute()
-            actual_email = user_info.get('email')
+            service = None
+            # Verify the authenticated email matches expected. The ID token comes straight
+            # from Google's token endpoint, so its signature is not checked (that would
+            # mean fetching Google's certificates).
+            if creds.id_token:
+                actual_email = jwt.decode(creds.id_token, verify=False).get('email')
+            else:
+                oauth2_service = build('oauth2', 'v2', credentials=creds, cache_discovery=False, static_discovery=True)
+                actual_email = _execute(oauth2_service.userinfo().get()).get('email')
             if actual_email != expected_email:
                 raise ValueError(
                     f"Wrong account! Expected {expected_email} but authenticated as {actual_email}. "
                     f"Please re-authenticate with the correct Google account."
                 )
         token_file.write_text(creds.to_json())
+    elif creds.refresh_token and creds.expiry and creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) < REFRESH_AHEAD:
+        _refresh_in_background(account, creds, token_file)
+
+    if service is None:
+        service = build('calendar', 'v3', credentials=creds, cache_discovery=False, static_discovery=True)
+        _services[account] = (creds, service)
+
+    return service
+
+
+def _refresh_in_background(account: str, creds, token_file: Path):
+    """Refresh credentials that are about to expire without blocking the caller."""
+    if account in _refreshing:
+        return
+    _refreshing.add(account)
+
+    def refresh():
+        from google.auth.transport.requests import Request
+        try:
+            creds.refresh(Request())
+            token_file.write_text(creds.to_json())
+        except Exception:
+            pass  # Refreshed on demand once the token has expired
+        finally:
+            _refreshing.discard(account)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+class GzipAuthorizedHttp(AuthorizedHttp):
+    """AuthorizedHttp that asks Google for gzip-compressed responses.
+
+    Google only compresses when the User-Agent contains "gzip". googleapiclient
+    adds that to regular requests but not to batch requests.
+    """
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        headers = dict(headers) if headers else {}
+        user_agent = headers.get("user-agent", "")
+        if "gzip" not in user_agent:
+            headers["user-agent"] = f"{user_agent} (gzip)".lstrip()
+        return super().request(uri, method, body=body, headers=headers, **kwargs)
+
 
-    return build('calendar', 'v3', credentials=creds)
+def _authorized_http(credentials):
+    """Get an HTTP client authorized with credentials, over this thread's connection."""
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        http = _thread_local.http = build_http()
+    return GzipAuthorizedHttp(credentials, http=http)
+
+
+def _execute(request):
+    """Execute an API request over the current thread's HTTP connection."""
+    return request.execute(http=_authorized_http(request.http.credentials))
+
+
+def _execute_batch(service, requests: dict) -> dict:
+    """Execute requests (keyed by ID) as batch HTTP requests and return responses by ID."""
+    responses = {}
+    errors = []
+
+    def collect(request_id, response, exception):
+        if exception is not None:
+            errors.append(exception)
+        else:
+            responses[request_id] = response
+
+    items = list(requests.items())
+    for i in range(0, len(items), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        for request_id, request in items[i:i + BATCH_SIZE]:
+            batch.add(request, request_id=request_id)
+        batch.execute(http=_authorized_http(items[i][1].http.credentials))
+
+    if errors:
+        raise errors[0]
+    return responses
+
+
+async def execute(request):
+    """Execute an API request in a worker thread so the event loop isn't blocked."""
+    return await asyncio.to_thread(_execute, request)
+
+
+async def execute_batch(service, requests: dict) -> dict:
+    """Execute batched requests in a worker thread so the event loop isn't blocked."""
+    return await asyncio.to_thread(_execute_batch, service, requests)
+
+
+def get_time_window(days: int) -> tuple[str, str]:
+    """Get now and now + days as UTC RFC 3339 strings, truncated to the second."""
+    now = datetime.now(timezone.utc)
+    end = now + timedelta(days=days)
+    return (now.isoformat(timespec='seconds').replace('+00:00', 'Z'),
+            end.isoformat(timespec='seconds').replace('+00:00', 'Z'))
 
 
 @mcp.tool()
-def list_calendars(account: str = "") -> str:
+async def list_calendars(account: str = "") -> str:
     """List all calendars accessible to this account, including shared calendars.
 
     Args:
         account: Account name from accounts.json. Uses default if not specified.
     """
-    service = get_calendar_service(account)
-    calendars_result = service.calendarList().list().execute()
+    service = await asyncio.to_thread(get_calendar_service, account)
+    calendars_result = await execute(service.calendarList().list(fields='items(id,summary,accessRole,primary)'))
     calendars = calendars_result.get('items', [])
 
     if not calendars:
@@ -119,7 +275,7 @@ def list_calendars(account: str = "") -> str:
 
 
 @mcp.tool()
-def list_events(days: int = 7, max_results: int = 20, account: str = "", calendar_id: str = "primary") -> str:
+async def list_events(days: int = 7, max_results: int = 20, account: str = "", calendar_id: str = "primary") -> str:
     """List upcoming calendar events.
 
     Args:
@@ -128,18 +284,18 @@ def list_events(days: int = 7, max_results: int = 20, account: str = "", calenda
         account: Account name from accounts.json. Uses default if not specified.
         calendar_id: Calendar ID to query (default "primary"). Use list_calendars to see available calendars.
     """
-    service = get_calendar_service(account)
-    now = datetime.utcnow().isoformat() + 'Z'
-    end = (datetime.utcnow() + timedelta(days=days)).isoformat() + 'Z'
+    service = await asyncio.to_thread(get_calendar_service, account)
+    now, end = get_time_window(days)
 
-    events_result = service.events().list(
+    events_result = await execute(service.events().list(
         calendarId=calendar_id,
         timeMin=now,
         timeMax=end,
         maxResults=max_results,
         singleEvents=True,
-        orderBy='startTime'
-    ).execute()
+        orderBy='startTime',
+        fields='items(id,summary,start,end,location,attendees/email)'
+    ))
 
     events = events_result.get('items', [])
     if not events:
@@ -167,15 +323,19 @@ def list_events(days: int = 7, max_results: int = 20, account: str = "", calenda
 
 
 @mcp.tool()
-def get_event(event_id: str, account: str = "") -> str:
+async def get_event(event_id: str, account: str = "") -> str:
     """Get details of a specific calendar event.
 
     Args:
         event_id: The ID of the event to retrieve
         account: Account name from accounts.json. Uses default if not specified.
     """
-    service = get_calendar_service(account)
-    event = service.events().get(calendarId='primary', eventId=event_id).execute()
+    service = await asyncio.to_thread(get_calendar_service, account)
+    event = await execute(service.events().get(
+        calendarId='primary',
+        eventId=event_id,
+        fields='summary,start,end,location,description,organizer/email,attendees(email,responseStatus),htmlLink'
+    ))
 
     attendees = event.get('attendees', [])
     attendee_info = "\n".join([
@@ -196,7 +356,7 @@ def get_event(event_id: str, account: str = "") -> str:
 
 
 @mcp.tool()
-def create_event(
+async def create_event(
     summary: str,
     start_time: str,
     end_time: str,
@@ -222,17 +382,15 @@ def create_event(
         jetlag: Set to True if traveling outside your home timezone
         account: Account name from accounts.json. Uses default if not specified.
     """
-    if not is_in_home_timezone() and not jetlag:
-        offset_hours = -time.timezone // 3600
-        if time.daylight and time.localtime().tm_isdst:
-            offset_hours = -time.altzone // 3600
+    offset_hours, at_home = check_home_timezone()
+    if not at_home and not jetlag:
         return (
             f"ERROR: Laptop is not in home timezone {HOME_TIMEZONE} (detected UTC{offset_hours:+d}). "
             f"To create events while traveling, set jetlag=True to confirm you want "
             f"to schedule in {HOME_TIMEZONE} despite being in a different timezone."
         )
 
-    service = get_calendar_service(account)
+    service = await asyncio.to_thread(get_calendar_service, account)
 
     event = {
         'summary': summary,
@@ -249,25 +407,25 @@ def create_event(
     if recurrence:
         event['recurrence'] = [recurrence]
 
-    created = service.events().insert(calendarId='primary', body=event).execute()
+    created = await execute(service.events().insert(calendarId='primary', body=event, fields='htmlLink'))
     return f"Event created: {created.get('htmlLink')}"
 
 
 @mcp.tool()
-def delete_event(event_id: str, account: str = "") -> str:
+async def delete_event(event_id: str, account: str = "") -> str:
     """Delete a calendar event.
 
     Args:
         event_id: The ID of the event to delete
         account: Account name from accounts.json. Uses default if not specified.
     """
-    service = get_calendar_service(account)
-    service.events().delete(calendarId='primary', eventId=event_id).execute()
+    service = await asyncio.to_thread(get_calendar_service, account)
+    await execute(service.events().delete(calendarId='primary', eventId=event_id))
     return f"Event {event_id} deleted successfully."
 
 
 @mcp.tool()
-def respond_to_event(event_id: str, response: str, account: str = "") -> str:
+async def respond_to_event(event_id: str, response: str, account: str = "") -> str:
     """Respond to a calendar invite (accept, decline, or tentative).
 
     Args:
@@ -280,27 +438,25 @@ def respond_to_event(event_id: str, response: str, account: str = "") -> str:
 
     account = account or DEFAULT_ACCOUNT
     user_email = ACCOUNTS[account]["email"]
-    service = get_calendar_service(account)
+    user_email_lower = user_email.lower()
+    service = await asyncio.to_thread(get_calendar_service, account)
 
-    event = service.events().get(calendarId='primary', eventId=event_id).execute()
+    # Attendees are patched back as a whole list, so fetch them complete
+    event = await execute(service.events().get(calendarId='primary', eventId=event_id, fields='summary,attendees'))
     attendees = event.get('attendees', [])
 
-    found = False
-    for attendee in attendees:
-        if attendee.get('email', '').lower() == user_email.lower():
-            attendee['responseStatus'] = response
-            found = True
-            break
-
-    if not found:
+    attendee = next((a for a in attendees if a.get('email', '').lower() == user_email_lower), None)
+    if attendee is None:
         return f"Could not find {user_email} in attendees list"
+    attendee['responseStatus'] = response
 
-    service.events().patch(calendarId='primary', eventId=event_id, body={'attendees': attendees}).execute()
+    await execute(service.events().patch(calendarId='primary', eventId=event_id, body={'attendees': attendees},
+                                         fields='id'))
     return f"Responded '{response}' to event: {event.get('summary', 'No title')}"
 
 
 @mcp.tool()
-def accept_all_invites(days: int = 7, account: str = "") -> str:
+async def accept_all_invites(days: int = 7, account: str = "") -> str:
     """Accept all pending calendar invites.
 
     Args:
@@ -309,36 +465,47 @@ def accept_all_invites(days: int = 7, account: str = "") -> str:
     """
     account = account or DEFAULT_ACCOUNT
     user_email = ACCOUNTS[account]["email"]
-    service = get_calendar_service(account)
-
-    now = datetime.utcnow().isoformat() + 'Z'
-    end = (datetime.utcnow() + timedelta(days=days)).isoformat() + 'Z'
+    user_email_lower = user_email.lower()
+    service = await asyncio.to_thread(get_calendar_service, account)
 
-    events_result = service.events().list(
-        calendarId='primary',
-        timeMin=now,
-        timeMax=end,
-        maxResults=50,
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
+    now, end = get_time_window(days)
 
-    events = events_result.get('items', [])
     accepted = []
+    page_token = None
+
+    while True:
+        events_result = await execute(service.events().list(
+            calendarId='primary',
+            timeMin=now,
+            timeMax=end,
+            maxResults=10,
+            singleEvents=True,
+            orderBy='startTime',
+            pageToken=page_token,
+            fields='items(id,summary,attendees),nextPageToken'
+        ))
+
+        patches = {}
+        for event in events_result.get('items', []):
+            attendees = event.get('attendees', [])
+            attendee = next((a for a in attendees if a.get('email', '').lower() == user_email_lower), None)
+            if attendee and attendee.get('responseStatus') == 'needsAction':
+                attendee['responseStatus'] = 'accepted'
+                patches[event['id']] = service.events().patch(
+                    calendarId='primary',
+                    eventId=event['id'],
+                    body={'attendees': attendees},
+                    fields='id'
+                )
+                accepted.append(event.get('summary', 'No title'))
 
-    for event in events:
-        attendees = event.get('attendees', [])
-        for attendee in attendees:
-            if attendee.get('email', '').lower() == user_email.lower():
-                if attendee.get('responseStatus') == 'needsAction':
-                    attendee['responseStatus'] = 'accepted'
-                    service.events().patch(
-                        calendarId='primary',
-                        eventId=event['id'],
-                        body={'attendees': attendees}
-                    ).execute()
-                    accepted.append(event.get('summary', 'No title'))
-                break
+        # Send this page's responses in one batched round-trip
+        if patches:
+            await execute_batch(service, patches)
+
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
 
     if not accepted:
         return "No pending invites found."
@@ -346,7 +513,7 @@ def accept_all_invites(days: int = 7, account: str = "") -> str:
 
 
 @mcp.tool()
-def search_events(query: str, days: int = 30, max_results: int = 20, account: str = "", calendar_id: str = "primary") -> str:
+async def search_events(query: str, days: int = 30, max_results: int = 20, account: str = "", calendar_id: str = "primary") -> str:
     """Search for calendar events.
 
     Args:
@@ -356,19 +523,19 @@ def search_events(query: str, days: int = 30, max_results: int = 20, account: st
         account: Account name from accounts.json. Uses default if not specified.
         calendar_id: Calendar ID to search (default "primary"). Use list_calendars to see available calendars.
     """
-    service = get_calendar_service(account)
-    now = datetime.utcnow().isoformat() + 'Z'
-    end = (datetime.utcnow() + timedelta(days=days)).isoformat() + 'Z'
+    service = await asyncio.to_thread(get_calendar_service, account)
+    now, end = get_time_window(days)
 
-    events_result = service.events().list(
+    events_result = await execute(service.events().list(
         calendarId=calendar_id,
         timeMin=now,
         timeMax=end,
         maxResults=max_results,
         singleEvents=True,
         orderBy='startTime',
-        q=query
-    ).execute()
+        q=query,
+        fields='items(id,summary,start)'
+    ))
 
     events = events_result.get('items', [])
     if not events:
@@ -1,20 +1,26 @@
 #!/usr/bin/env python3
 """Gmail MCP Server - Read and send emails via Gmail API."""
 
+import asyncio
 import base64
+import html
+import io
 import json
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage, MIMEPart
 from email.utils import formataddr
+from functools import lru_cache
 import mimetypes
+import mmap
+import os
+import uuid
 from pathlib import Path
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
 from mcp.server.fastmcp import FastMCP
 
 SCOPES = [
@@ -28,33 +34,102 @@ SCOPES = [
 DIR = Path(__file__).parent
 CREDENTIALS_FILE = list(DIR.glob("client_secret_*.json"))[0]
 CONFIG_FILE = DIR / "accounts.json"
+# Gmail accepts at most 100 requests per batch
+BATCH_SIZE = 100
+# Headers shown by list_emails and read_email; format='full' returns every header
+LIST_HEADERS = ('From', 'Subject', 'Date')
+READ_HEADERS = ('From', 'To', 'Subject', 'Date')
+# Preference among body parts shown by read_email
+BODY_PART_SCORES = {'text/plain': 2, 'text/html': 1}
+# Attachments are base64-encoded this many bytes at a time: 1024 whole 76-character lines
+ATTACHMENT_SLICE = 57 * 1024
+
+
+@lru_cache(maxsize=1)
+def _read_config(mtime_ns: int) -> dict:
+    """Read accounts configuration as of the given file modification time (0 if missing)."""
+    if not mtime_ns:
+        return {"accounts": {"default": "token.json"}, "default_account": "default"}
+    return json.loads(CONFIG_FILE.read_text())
 
 
 def load_config():
-    """Load accounts configuration."""
-    if not CONFIG_FILE.exists():
-        return {"accounts": {"default": "token.json"}, "default_account": "default"}
-    return json.loads(CONFIG_FILE.read_text())
+    """Load accounts configuration, only re-reading the file after it changes."""
+    try:
+        mtime_ns = CONFIG_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = 0
+    return _read_config(mtime_ns)
 
 
-config = load_config()
-ACCOUNTS = config.get("accounts", {})
-DEFAULT_ACCOUNT = config.get("default_account", list(ACCOUNTS.keys())[0])
+def get_accounts() -> tuple[dict, str]:
+    """Get the configured accounts and the default account name."""
+    config = load_config()
+    accounts = config.get("accounts", {})
+    return accounts, config.get("default_account", list(accounts.keys())[0])
 
 mcp = FastMCP("gmail")
 
 
+# Authenticated (credentials, service) pairs, keyed by account_key
+_services = {}
+_services_lock = threading.Lock()
+
+# Cached credentials this close to expiry are refreshed in the background
+REFRESH_AHEAD = timedelta(minutes=5)
+# Account keys with a background refresh in flight
+_refreshing = set()
+
+# One HTTP connection per thread, shared by every account and service; kept
+# alive between requests (httplib2 connections are not thread-safe)
+_thread_local = threading.local()
+
+# (email, display name) of each account's sender, keyed by account_key and looked up on first use
+_user_info = {}
+
+# Worker threads for retrying failed batch items concurrently; capped to stay
+# within Gmail's per-user rate limits
+_executor = ThreadPoolExecutor(max_workers=10)
+
+
+def account_key(account: str = "") -> tuple[str, str, str]:
+    """Get the (name, token file, email) of an account, as configured right now.
+
+    Cached state is keyed by this, so editing an account's token or email in
+    accounts.json takes effect without a restart.
+    """
+    accounts, default_account = get_accounts()
+    account = account or default_account
+    if account not in accounts:
+        raise ValueError(f"Unknown account: {account}. Valid accounts: {list(accounts.keys())}")
+    account_info = accounts[account]
+    return account, account_info["token"], account_info["email"]
+
+
 def get_gmail_service(account: str = ""):
-    """Get authenticated Gmail service for specified account."""
-    account = account or DEFAULT_ACCOUNT
-    if account not in ACCOUNTS:
-        raise ValueError(f"Unknown account: {account}. Valid accounts: {list(ACCOUNTS.keys())}")
-
-    account_info = ACCOUNTS[account]
-    token_file = DIR / account_info["token"]
-    expected_email = account_info["email"]
-    creds = None
-    if token_file.exists():
+    """Get authenticated Gmail service for specified account.
+
+    Services are cached per account; expired credentials are refreshed in place
+    and the service is only rebuilt after a new OAuth flow.
+    """
+    key = account_key(account)
+    with _services_lock:
+        return _get_gmail_service(key)
+
+
+def _get_gmail_service(key: tuple[str, str, str]):
+    # Only needed to authenticate and build the service, and slow to import,
+    # so they are loaded on first use rather than at server start
+    from google.auth import jwt
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from googleapiclient.discovery import build
+
+    _, token, expected_email = key
+    token_file = DIR / token
+    creds, service = _services.get(key, (None, None))
+    if creds is None and token_file.exists():
         creds = Credentials.from_authorized_user_file(str(token_file), SCOPES)
 
     if not creds or not creds.valid:
@@ -63,22 +138,122 @@ def get_gmail_service(account: str = ""):
         else:
             flow = InstalledAppFlow.from_client_secrets_file(str(CREDENTIALS_FILE), SCOPES)
             creds = flow.run_local_server(port=0)
-            # Verify the authenticated email matches expected
-            oauth2_service = build('oauth2', 'v2', credentials=creds)
-            user_info = oauth2_service.userinfo().get().execute()
-            actual_email = user_info.get('email')
+            service = None
+            _user_info.pop(key, None)
+            # Verify the authenticated email matches expected. The ID token comes straight
+            # from Google's token endpoint, so its signature is not checked (that would
+            # mean fetching Google's certificates).
+            if creds.id_token:
+                actual_email = jwt.decode(creds.id_token, verify=False).get('email')
+            else:
+                oauth2_service = build('oauth2', 'v2', credentials=creds, cache_discovery=False, static_discovery=True)
+                actual_email = _execute(oauth2_service.userinfo().get()).get('email')
             if actual_email != expected_email:
                 raise ValueError(
                     f"Wrong account! Expected {expected_email} but authenticated as {actual_email}. "
                     f"Please re-authenticate with the correct Google account."
                 )
         token_file.write_text(creds.to_json())
+    elif creds.refresh_token and creds.expiry and creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None) < REFRESH_AHEAD:
+        _refresh_in_background(key, creds, token_file)
+
+    if service is None:
+        service = build('gmail', 'v1', credentials=creds, cache_discovery=False, static_discovery=True)
+        _services[key] = (creds, service)
+
+    return service
+
+
+def _refresh_in_background(key: tuple[str, str, str], creds, token_file: Path):
+    """Refresh credentials that are about to expire without blocking the caller."""
+    if key in _refreshing:
+        return
+    _refreshing.add(key)
+
+    def refresh():
+        from google.auth.transport.requests import Request
+        try:
+            creds.refresh(Request())
+            token_file.write_text(creds.to_json())
+        except Exception:
+            pass  # Refreshed on demand once the token has expired
+        finally:
+            _refreshing.discard(key)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+class GzipAuthorizedHttp(AuthorizedHttp):
+    """AuthorizedHttp that asks Google for gzip-compressed responses.
+
+    Google only compresses when the User-Agent contains "gzip". googleapiclient
+    adds that to regular requests but not to batch requests.
+    """
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        headers = dict(headers) if headers else {}
+        user_agent = headers.get("user-agent", "")
+        if "gzip" not in user_agent:
+            headers["user-agent"] = f"{user_agent} (gzip)".lstrip()
+        return super().request(uri, method, body=body, headers=headers, **kwargs)
+
+
+def _authorized_http(credentials):
+    """Get an HTTP client authorized with credentials, over this thread's connection."""
+    http = getattr(_thread_local, "http", None)
+    if http is None:
+        http = _thread_local.http = build_http()
+    return GzipAuthorizedHttp(credentials, http=http)
+
+
+def _execute(request, num_retries: int = 0):
+    """Execute an API request over the current thread's HTTP connection."""
+    return request.execute(http=_authorized_http(request.http.credentials), num_retries=num_retries)
+
+
+def _execute_batch(service, requests: dict) -> dict:
+    """Execute requests (keyed by ID) as batch HTTP requests and return responses by ID.
+
+    Requests that fail inside a batch (typically rate limiting), or whose whole
+    batch fails, are retried individually and concurrently.
+    """
+    responses = {}
+
+    def collect(request_id, response, exception):
+        if exception is None:
+            responses[request_id] = response
 
-    return build('gmail', 'v1', credentials=creds)
+    items = list(requests.items())
+    for i in range(0, len(items), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        for request_id, request in items[i:i + BATCH_SIZE]:
+            batch.add(request, request_id=request_id)
+        try:
+            batch.execute(http=_authorized_http(items[i][1].http.credentials))
+        except HttpError:
+            pass
+
+    failed = [request_id for request_id in requests if request_id not in responses]
+    futures = {request_id: _executor.submit(_execute, requests[request_id], num_retries=3)
+               for request_id in failed}
+    for request_id, future in futures.items():
+        responses[request_id] = future.result()
+
+    return responses
+
+
+async def execute(request):
+    """Execute an API request in a worker thread so the event loop isn't blocked."""
+    return await asyncio.to_thread(_execute, request)
+
+
+async def execute_batch(service, requests: dict) -> dict:
+    """Execute batched requests in a worker thread so the event loop isn't blocked."""
+    return await asyncio.to_thread(_execute_batch, service, requests)
 
 
 @mcp.tool()
-def list_emails(max_results: int = 10, query: str = "", account: str = "") -> str:
+async def list_emails(max_results: int = 10, query: str = "", account: str = "") -> str:
     """List recent emails from inbox.
 
     Args:
@@ -86,27 +261,34 @@ def list_emails(max_results: int = 10, query: str = "", account: str = "") -> st
         query: Gmail search query (e.g., "from:example@gmail.com", "is:unread", "subject:hello")
         account: Account name from accounts.json. Uses default if not specified.
     """
-    service = get_gmail_service(account)
-    results = service.users().messages().list(
+    service = await asyncio.to_thread(get_gmail_service, account)
+    results = await execute(service.users().messages().list(
         userId='me',
         maxResults=max_results,
-        q=query or "in:inbox"
-    ).execute()
+        q=query or "in:inbox",
+        fields='messages/id'
+    ))
 
     messages = results.get('messages', [])
     if not messages:
         return "No emails found."
 
-    output = []
-    for msg in messages:
-        msg_data = service.users().messages().get(
+    # Fetch all message metadata in batched round-trips
+    msg_data_by_id = await execute_batch(service, {
+        msg['id']: service.users().messages().get(
             userId='me',
             id=msg['id'],
             format='metadata',
-            metadataHeaders=['From', 'Subject', 'Date']
-        ).execute()
+            metadataHeaders=list(LIST_HEADERS),
+            fields='id,snippet,payload/headers'
+        )
+        for msg in messages
+    })
 
-        headers = {h['name']: h['value'] for h in msg_data['payload']['headers']}
+    output = []
+    for msg in messages:
+        msg_data = msg_data_by_id[msg['id']]
+        headers = pick_headers(msg_data.get('payload', {}).get('headers', []), LIST_HEADERS)
         snippet = msg_data.get('snippet', '')[:100]
 
         output.append(f"ID: {msg['id']}\n"
@@ -119,30 +301,28 @@ def list_emails(max_results: int = 10, query: str = "", account: str = "") -> st
 
 
 @mcp.tool()
-def read_email(email_id: str, account: str = "") -> str:
+async def read_email(email_id: str, account: str = "") -> str:
     """Read the full content of a specific email.
 
     Args:
         email_id: The ID of the email to read (from list_emails)
         account: Account name from accounts.json. Uses default if not specified.
     """
-    service = get_gmail_service(account)
-    msg = service.users().messages().get(userId='me', id=email_id, format='full').execute()
+    service = await asyncio.to_thread(get_gmail_service, account)
+    msg = await execute(service.users().messages().get(userId='me', id=email_id, format='full'))
 
-    headers = {h['name']: h['value'] for h in msg['payload']['headers']}
+    headers = pick_headers(msg['payload']['headers'], READ_HEADERS)
 
     body = ""
-    payload = msg['payload']
-
-    if 'body' in payload and payload['body'].get('data'):
-        body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8')
-    elif 'parts' in payload:
-        for part in payload['parts']:
-            if part['mimeType'] == 'text/plain' and part['body'].get('data'):
-                body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-                break
-            elif part['mimeType'] == 'text/html' and part['body'].get('data') and not body:
-                body = base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
+    body_part = _find_body_part(msg['payload'])
+    if body_part:
+        data = body_part['body'].get('data')
+        if not data:
+            # Large bodies are not inlined in the message; fetch them like an attachment
+            data = (await execute(service.users().messages().attachments().get(
+                userId='me', messageId=email_id, id=body_part['body']['attachmentId'], fields='data'
+            )))['data']
+        body = base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
 
     return (f"From: {headers.get('From', 'Unknown')}\n"
             f"To: {headers.get('To', 'Unknown')}\n"
@@ -151,31 +331,105 @@ def read_email(email_id: str, account: str = "") -> str:
             f"\n{body}")
 
 
-def get_user_email(service):
-    """Get the authenticated user's email and name."""
-    profile = service.users().getProfile(userId='me').execute()
+def pick_headers(headers: list, wanted: tuple) -> dict:
+    """Get the values of the wanted headers, stopping once all of them are found."""
+    wanted = set(wanted)
+    picked = {}
+    for header in headers:
+        name = header['name']
+        if name in wanted and name not in picked:
+            picked[name] = header['value']
+            if len(picked) == len(wanted):
+                break
+    return picked
+
+
+def _walk_parts(part):
+    """Yield a message part and all of its nested parts, depth first."""
+    yield part
+    for subpart in part.get('parts', []):
+        yield from _walk_parts(subpart)
+
+
+def _find_body_part(payload):
+    """Find the part to show as the body: the first text/plain part, else the first text/html part.
+
+    Parts with a filename are attachments and never chosen. The body of the
+    returned part holds either inline 'data' or, for large bodies, an 'attachmentId'.
+    """
+    if payload.get('body', {}).get('data'):
+        return payload
+    candidates = (part for part in _walk_parts(payload)
+                  if part['mimeType'] in BODY_PART_SCORES and not part.get('filename')
+                  and (part['body'].get('data') or part['body'].get('attachmentId')))
+    return max(candidates, key=lambda part: BODY_PART_SCORES[part['mimeType']], default=None)
+
+
+def get_user_email(service, key: tuple[str, str, str]):
+    """Get the authenticated user's email and name, cached per account_key."""
+    if key in _user_info:
+        return _user_info[key]
+    profile = _execute(service.users().getProfile(userId='me'))
     email = profile.get('emailAddress', '')
     # Get display name from settings if available
-    settings = service.users().settings().sendAs().get(userId='me', sendAsEmail=email).execute()
+    settings = _execute(service.users().settings().sendAs().get(userId='me', sendAsEmail=email))
     display_name = settings.get('displayName', '')
+    _user_info[key] = email, display_name
     return email, display_name
 
 
 def text_to_html(text: str) -> str:
     """Convert plain text to HTML with proper paragraph tags."""
-    import html
-    paragraphs = text.strip().split('\n\n')
-    html_parts = []
-    for p in paragraphs:
-        # Escape HTML entities and convert single newlines to <br>
-        escaped = html.escape(p.strip())
-        escaped = escaped.replace('\n', '<br>\n')
-        html_parts.append(f'<p>{escaped}</p>')
-    return '\n'.join(html_parts)
+    # Escape HTML entities once, then split into paragraphs and convert single newlines to <br>
+    paragraphs = html.escape(text.strip()).split('\n\n')
+    return '\n'.join('<p>' + p.strip().replace('\n', '<br>\n') + '</p>' for p in paragraphs)
+
+
+def is_plain_header(value: str) -> bool:
+    """Check if a header value can be written as-is: ASCII, one line, and short enough not to need folding."""
+    return value.isascii() and '\r' not in value and '\n' not in value and len(value) <= 900
+
+
+def render_alternative(headers: list, text: str, html_text: str) -> bytes:
+    """Render a multipart/alternative text and HTML message without the email package.
+
+    Header values must pass is_plain_header. Both bodies are base64-encoded, so
+    any text is safe to include.
+    """
+    boundary = uuid.uuid4().hex
+    lines = [f"{name}: {value}" for name, value in headers]
+    lines += ["MIME-Version: 1.0", f'Content-Type: multipart/alternative; boundary="{boundary}"', ""]
+    for subtype, content in (("plain", text), ("html", html_text)):
+        encoded = base64.encodebytes(content.encode('utf-8')).decode('ascii')
+        lines += [f"--{boundary}", f'Content-Type: text/{subtype}; charset="utf-8"',
+                  "Content-Transfer-Encoding: base64", "", encoded.replace('\n', '\r\n')]
+    lines.append(f"--{boundary}--")
+    return "\r\n".join(lines).encode('ascii')
+
+
+def attachment_part(path: Path, mime_type: str) -> MIMEPart:
+    """Build a base64 attachment part, encoding the memory-mapped file a slice at a time.
+
+    Only the encoded text is held in full; the file itself is never read into memory.
+    """
+    encoded = io.StringIO()
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:  # Empty files can't be mapped
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for start in range(0, len(mm), ATTACHMENT_SLICE):
+                    lines = base64.encodebytes(mm[start:start + ATTACHMENT_SLICE])
+                    encoded.write(lines.decode('ascii').replace('\n', '\r\n'))
+
+    part = MIMEPart()
+    part['Content-Type'] = mime_type
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.add_header('Content-Disposition', 'attachment', filename=path.name)
+    part.set_payload(encoded.getvalue())
+    return part
 
 
 @mcp.tool()
-def send_email(to: str, subject: str, body: str, cc: str = "", bcc: str = "", reply_to_id: str = "", attachments: str = "", account: str = "") -> str:
+async def send_email(to: str, subject: str, body: str, cc: str = "", bcc: str = "", reply_to_id: str = "", attachments: str = "", account: str = "") -> str:
     """Send an email.
 
     Args:
@@ -188,42 +442,50 @@ def send_email(to: str, subject: str, body: str, cc: str = "", bcc: str = "", re
         attachments: Optional comma-separated list of file paths to attach
         account: Account name from accounts.json. Uses default if not specified.
     """
-    service = get_gmail_service(account)
-
-    message = MIMEMultipart('mixed')
+    key = account_key(account)
+    service = await asyncio.to_thread(get_gmail_service, key[0])
 
-    # Get sender info and set From header with display name
-    sender_email, sender_name = get_user_email(service)
-    message['From'] = formataddr((sender_name, sender_email))
-    message['To'] = to
+    # The sender and original message lookups are independent; run them together
+    sender_lookup = asyncio.to_thread(get_user_email, service, key)
+    orig = None
+    if reply_to_id:
+        (sender_email, sender_name), orig = await asyncio.gather(sender_lookup, execute(
+            service.users().messages().get(userId='me', id=reply_to_id, format='metadata',
+                                           metadataHeaders=['Message-ID'], fields='threadId,payload/headers')))
+    else:
+        sender_email, sender_name = await sender_lookup
+
+    # From header with display name
+    headers = [('From', formataddr((sender_name, sender_email))), ('To', to)]
     if cc:
-        message['Cc'] = cc
+        headers.append(('Cc', cc))
     if bcc:
-        message['Bcc'] = bcc
-    message['Subject'] = subject
+        headers.append(('Bcc', bcc))
+    headers.append(('Subject', subject))
 
     thread_id = None
-    if reply_to_id:
-        orig = service.users().messages().get(userId='me', id=reply_to_id, format='metadata',
-                                               metadataHeaders=['Message-ID']).execute()
-        orig_headers = {h['name']: h['value'] for h in orig['payload']['headers']}
+    if orig:
+        orig_headers = pick_headers(orig.get('payload', {}).get('headers', []), ('Message-ID',))
         thread_id = orig.get('threadId')
         if 'Message-ID' in orig_headers:
-            message['In-Reply-To'] = orig_headers['Message-ID']
-            message['References'] = orig_headers['Message-ID']
-
-    # Create alternative part for text/html body
-    text_part = MIMEMultipart('alternative')
-    text_part.attach(MIMEText(body, 'plain'))
-    text_part.attach(MIMEText(text_to_html(body), 'html'))
-    message.attach(text_part)
-
-    # Handle attachments
-    if attachments:
-        for filepath in attachments.split(','):
-            filepath = filepath.strip()
-            if not filepath:
-                continue
+            headers.append(('In-Reply-To', orig_headers['Message-ID']))
+            headers.append(('References', orig_headers['Message-ID']))
+
+    html_body = text_to_html(body)
+    filepaths = [filepath.strip() for filepath in attachments.split(',') if filepath.strip()]
+
+    if not filepaths and all(is_plain_header(value) for _, value in headers):
+        message_bytes = render_alternative(headers, body, html_body)
+    else:
+        message = EmailMessage()
+        for name, value in headers:
+            message[name] = value
+
+        # Plain text body with an HTML alternative; attachments below wrap it in multipart/mixed
+        message.set_content(body)
+        message.add_alternative(html_body, subtype='html')
+
+        for filepath in filepaths:
             path = Path(filepath).expanduser()
             if not path.exists():
                 return f"Error: Attachment not found: {filepath}"
@@ -231,27 +493,25 @@ def send_email(to: str, subject: str, body: str, cc: str = "", bcc: str = "", re
             mime_type, _ = mimetypes.guess_type(str(path))
             if mime_type is None:
                 mime_type = 'application/octet-stream'
-            main_type, sub_type = mime_type.split('/', 1)
 
-            with open(path, 'rb') as f:
-                attachment = MIMEBase(main_type, sub_type)
-                attachment.set_payload(f.read())
-            encoders.encode_base64(attachment)
-            attachment.add_header('Content-Disposition', 'attachment', filename=path.name)
-            message.attach(attachment)
+            if message.get_content_type() != 'multipart/mixed':
+                message.make_mixed()
+            message.attach(await asyncio.to_thread(attachment_part, path, mime_type))
+
+        message_bytes = bytes(message)
 
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+    raw = base64.urlsafe_b64encode(message_bytes).decode('ascii')
 
     send_body = {'raw': raw}
     if thread_id:
         send_body['threadId'] = thread_id
 
-    sent = service.users().messages().send(userId='me', body=send_body).execute()
+    sent = await execute(service.users().messages().send(userId='me', body=send_body))
     return f"Email sent successfully. Message ID: {sent['id']}"
 
 
 @mcp.tool()
-def search_emails(query: str, max_results: int = 20, account: str = "") -> str:
+async def search_emails(query: str, max_results: int = 20, account: str = "") -> str:
     """Search emails using Gmail's search syntax.
 
     Args:
@@ -264,7 +524,7 @@ def search_emails(query: str, max_results: int = 20, account: str = "") -> str:
         max_results: Maximum number of results (default 20)
         account: Account name from accounts.json. Uses default if not specified.
     """
-    return list_emails(max_results=max_results, query=query, account=account)
+    return await list_emails(max_results=max_results, query=query, account=account)
 
 
 if __name__ == "__main__":
@@ -1,71 +1,320 @@
 #!/usr/bin/env python3
 """Apple Messages MCP Server - Read and send iMessages/SMS via macOS."""
 
+import io
+import os
 import sqlite3
 import subprocess
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from mcp.server.fastmcp import FastMCP
 
 MESSAGES_DB = Path.home() / "Library/Messages/chat.db"
+# Escapes text for use inside an AppleScript string literal
+APPLESCRIPT_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': ''})
+# Messages timestamps are nanoseconds since this date
+APPLE_EPOCH = datetime(2001, 1, 1)
+# Full-text index of message text. It copies every message out of chat.db, so it is
+# kept out of the repo and readable only by the user; chat.db itself is only ever read
+SEARCH_DB = Path.home() / "Library/Application Support/email_client/messages_fts.sqlite"
+# Bump when the index layout changes; the index is then rebuilt
+SEARCH_SCHEMA_VERSION = 1
+# Messages can be edited for 15 minutes after sending, so older ones are not re-checked
+# for edits; generous, to allow for clock skew and late delivery
+EDIT_WINDOW = timedelta(hours=1)
+# Deleted messages already drop out of results through the join with chat.db, so
+# the index only looks for them this often
+PRUNE_INTERVAL = timedelta(hours=1)
+# The trigram tokenizer only matches queries of at least three characters
+MIN_INDEXED_QUERY = 3
 
 mcp = FastMCP("messages")
 
 
+# Shared read-only connection to the Messages database, opened on first use
+_db = None
+_db_lock = threading.Lock()
+
+
 def get_messages_db():
-    """Get connection to Messages database."""
-    return sqlite3.connect(str(MESSAGES_DB))
+    """Get the shared read-only connection to the Messages database.
 
+    Not opened as immutable: Messages keeps writing to the database while we read it.
+    """
+    global _db
+    if _db is None:
+        conn = sqlite3.connect(f"{MESSAGES_DB.as_uri()}?mode=ro", uri=True, check_same_thread=False)
+        conn.executescript("""
+            PRAGMA query_only = 1;
+            PRAGMA mmap_size = 268435456;
+            PRAGMA cache_size = -65536;
+            PRAGMA temp_store = MEMORY;
+        """)
+        _db = conn
+    return _db
 
-@mcp.tool()
-def list_conversations(limit: int = 20) -> str:
-    """List recent conversations.
 
-    Args:
-        limit: Maximum number of conversations to return (default 20)
+def query_messages_db(query: str, params: tuple) -> list:
+    """Run a query on the shared Messages database connection and fetch all rows."""
+    with _db_lock:
+        return get_messages_db().execute(query, params).fetchall()
+
+
+# Connection to the search index, False if it can't be opened (e.g. this SQLite
+# lacks FTS5 trigram support, or chat.db can't be attached)
+_search_db = None
+# chat.db's data_version as of the last index sync, and when deletions were last pruned
+_synced_data_version = None
+_pruned_at = float('-inf')
+
+
+def get_search_db():
+    """Get the connection to the search index, with chat.db attached read-only as "src".
+
+    Returns None if the index is unavailable.
+    """
+    global _search_db
+    if _search_db is None:
+        _search_db = open_search_db() or False
+    return _search_db or None
+
+
+def open_search_db():
+    """Open the search index, creating it owner-only if needed; None if that fails."""
+    SEARCH_DB.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+    # Create the file before SQLite does, so it never exists with wider permissions;
+    # SQLite gives its journal files the same mode
+    os.close(os.open(SEARCH_DB, os.O_RDWR | os.O_CREAT, 0o600))
+    os.chmod(SEARCH_DB, 0o600)
+
+    conn = sqlite3.connect(SEARCH_DB.as_uri(), uri=True, check_same_thread=False)
+    try:
+        # Overwrite the text of deleted messages instead of leaving it in free pages
+        conn.execute("PRAGMA secure_delete = ON")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != SEARCH_SCHEMA_VERSION:
+            conn.executescript(f"""
+                DROP TABLE IF EXISTS message_fts;
+                DROP TABLE IF EXISTS indexed;
+                DROP TABLE IF EXISTS sync_state;
+                CREATE VIRTUAL TABLE message_fts USING fts5(text, tokenize='trigram');
+                CREATE TABLE indexed (rowid INTEGER PRIMARY KEY);
+                CREATE TABLE sync_state (
+                    last_rowid INTEGER NOT NULL, last_changed INTEGER NOT NULL, edit_floor INTEGER NOT NULL
+                );
+                PRAGMA user_version = {SEARCH_SCHEMA_VERSION};
+            """)
+        conn.execute("ATTACH DATABASE ? AS src", (f"{MESSAGES_DB.as_uri()}?mode=ro",))
+    except sqlite3.OperationalError:
+        conn.close()
+        return None
+    return conn
+
+
+def message_change_time(conn):
+    """Get an SQL expression for when a chat.db message was last edited or unsent.
+
+    Returns None if this chat.db has no edit timestamps.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA src.table_info(message)")}
+    changed = [f"COALESCE({column}, 0)" for column in ("date_edited", "date_retracted") if column in columns]
+    if not changed:
+        return None
+    return changed[0] if len(changed) == 1 else f"MAX({', '.join(changed)})"
+
+
+def sync_search_index(conn, changed_at: str):
+    """Bring the index in line with chat.db: index new messages, re-index edited
+    or unsent ones, and every PRUNE_INTERVAL drop deleted ones.
+
+    chat.db allocates ROWIDs with AUTOINCREMENT, so new messages are the ones
+    above the last sync's sequence, and a lower sequence means chat.db was
+    replaced. Edits are found by edit/unsend timestamps newer than the last
+    sync (changed_at is the SQL expression for them from message_change_time),
+    among messages above edit_floor: every message below it was sent more than
+    EDIT_WINDOW before the last sync. The indexed table records every synced
+    message (with or without text), so deletions show up as a difference in
+    row counts.
+    """
+    global _pruned_at
+    prune = time.monotonic() - _pruned_at >= PRUNE_INTERVAL.total_seconds()
+    # Start of the edit window, in Messages' nanoseconds
+    edit_since = datetime.now(timezone.utc).replace(tzinfo=None) - EDIT_WINDOW
+    edit_cutoff = (edit_since - APPLE_EPOCH) // timedelta(microseconds=1) * 1000
+    # One transaction, so chat.db is also read from a single snapshot
+    conn.execute("BEGIN")
+    try:
+        row = conn.execute("SELECT last_rowid, last_changed, edit_floor FROM sync_state").fetchone()
+        last_rowid, last_changed, edit_floor = row if row else (0, 0, 0)
+        row = conn.execute("SELECT seq FROM src.sqlite_sequence WHERE name = 'message'").fetchone()
+        max_rowid = row[0] if row else 0
+
+        if max_rowid < last_rowid:
+            # chat.db was replaced; rebuild the index from scratch
+            conn.execute("DELETE FROM message_fts")
+            conn.execute("DELETE FROM indexed")
+            last_rowid = last_changed = edit_floor = 0
+
+        # Already indexed messages whose text was edited or unsent since the last sync
+        changed = conn.execute(f"""
+            SELECT ROWID, text, {changed_at} FROM src.message WHERE ROWID > ? AND {changed_at} > ?
+        """, (edit_floor, last_changed)).fetchall()
+        reindexed = [(rowid, text) for rowid, text, _ in changed if rowid <= last_rowid]
+        conn.executemany("DELETE FROM message_fts WHERE rowid = ?", [(rowid,) for rowid, _ in reindexed])
+        conn.executemany("INSERT INTO message_fts(rowid, text) VALUES (?, ?)",
+                         [(rowid, text) for rowid, text in reindexed if text is not None])
+        last_changed = max((changed_time for _, _, changed_time in changed), default=last_changed)
+
+        if max_rowid > last_rowid:
+            conn.execute("INSERT INTO indexed(rowid) SELECT ROWID FROM src.message WHERE ROWID > ?",
+                         (last_rowid,))
+            conn.execute("""
+                INSERT INTO message_fts(rowid, text)
+                SELECT ROWID, text FROM src.message
+                WHERE ROWID > ? AND text IS NOT NULL
+            """, (last_rowid,))
+
+        # Messages sent within EDIT_WINDOW are all above the first one among them
+        edit_floor = conn.execute("""
+            SELECT COALESCE(MIN(ROWID) - 1, ?) FROM src.message WHERE ROWID > ? AND date > ?
+        """, (max_rowid, edit_floor, edit_cutoff)).fetchone()[0]
+        conn.execute("DELETE FROM sync_state")
+        conn.execute("INSERT INTO sync_state VALUES (?, ?, ?)", (max_rowid, last_changed, edit_floor))
+
+        if prune:
+            indexed_count = conn.execute("SELECT COUNT(*) FROM indexed").fetchone()[0]
+            message_count = conn.execute("SELECT COUNT(*) FROM src.message").fetchone()[0]
+            if indexed_count != message_count:
+                # Messages were deleted from chat.db; drop their text from the index too
+                conn.execute("""
+                    DELETE FROM message_fts WHERE rowid IN (
+                        SELECT rowid FROM indexed WHERE rowid NOT IN (SELECT ROWID FROM src.message)
+                    )
+                """)
+                conn.execute("DELETE FROM indexed WHERE rowid NOT IN (SELECT ROWID FROM src.message)")
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    if prune:
+        _pruned_at = time.monotonic()
+
+
+# Index hits are re-checked with LIKE, which keeps the case folding of the unindexed search
+INDEXED_SEARCH_QUERY = """
+    SELECT
+        message.text,
+        message.is_from_me,
+        message.date,
+        chat.chat_identifier,
+        chat.display_name
+    FROM src.message
+    JOIN src.chat_message_join ON message.ROWID = chat_message_join.message_id
+    JOIN src.chat ON chat_message_join.chat_id = chat.ROWID
+    WHERE message.ROWID IN (SELECT rowid FROM message_fts WHERE message_fts MATCH ?)
+      AND message.text LIKE ?
+    ORDER BY message.date DESC
+    LIMIT ?
     """
-    conn = get_messages_db()
-    cursor = conn.cursor()
 
-    query = """
+
+def search_index(query: str, limit: int):
+    """Find messages containing query through the search index.
+
+    Returns None if the index is unavailable or chat.db has no edit timestamps.
+    """
+    global _synced_data_version
+    phrase = '"' + query.replace('"', '""') + '"'
+
+    with _db_lock:
+        conn = get_search_db()
+        if conn is None:
+            return None
+        changed_at = message_change_time(conn)
+        if changed_at is None:
+            # Edits to indexed messages couldn't be detected, so the index could miss them
+            return None
+        # data_version only changes when another connection (Messages) writes to chat.db
+        data_version = conn.execute("PRAGMA src.data_version").fetchone()[0]
+        if data_version != _synced_data_version:
+            sync_search_index(conn, changed_at)
+            _synced_data_version = data_version
+        return conn.execute(INDEXED_SEARCH_QUERY, (phrase, f"%{query}%", limit)).fetchall()
+
+
+# Number each chat's messages newest first in a single pass, then keep the newest
+LIST_CONVERSATIONS_QUERY = """
+    WITH last_msg AS (
+        SELECT
+            chat_message_join.chat_id,
+            message.date,
+            message.text,
+            ROW_NUMBER() OVER (
+                PARTITION BY chat_message_join.chat_id ORDER BY message.ROWID DESC
+            ) as rn
+        FROM message
+        JOIN chat_message_join ON message.ROWID = chat_message_join.message_id
+    )
     SELECT
         chat.chat_identifier,
         chat.display_name,
-        MAX(message.date) as last_message_date,
-        (SELECT text FROM message m2
-         WHERE m2.ROWID = (
-             SELECT MAX(m3.ROWID) FROM message m3
-             JOIN chat_message_join cmj2 ON m3.ROWID = cmj2.message_id
-             WHERE cmj2.chat_id = chat.ROWID
-         )) as last_message
+        last_msg.date as last_message_date,
+        last_msg.text as last_message
     FROM chat
-    JOIN chat_message_join ON chat.ROWID = chat_message_join.chat_id
-    JOIN message ON chat_message_join.message_id = message.ROWID
-    GROUP BY chat.ROWID
+    JOIN last_msg ON last_msg.chat_id = chat.ROWID
+    WHERE last_msg.rn = 1
     ORDER BY last_message_date DESC
     LIMIT ?
     """
 
-    cursor.execute(query, (limit,))
-    rows = cursor.fetchall()
-    conn.close()
+
+@mcp.tool()
+def list_conversations(limit: int = 20) -> str:
+    """List recent conversations.
+
+    Args:
+        limit: Maximum number of conversations to return (default 20)
+    """
+    rows = query_messages_db(LIST_CONVERSATIONS_QUERY, (limit,))
 
     if not rows:
         return "No conversations found."
 
-    output = []
+    output = io.StringIO()
     for row in rows:
         chat_id, display_name, last_date, last_msg = row
         name = display_name or chat_id
         preview = (last_msg[:80] + "...") if last_msg and len(last_msg) > 80 else (last_msg or "")
-        output.append(
+        if output.tell():
+            output.write("\n---\n")
+        output.write(
             f"Chat: {name}\n"
             f"ID: {chat_id}\n"
             f"Last message: {preview}\n"
         )
 
-    return "\n---\n".join(output)
+    return output.getvalue()
+
+
+# Take the newest messages, then return them oldest first for display
+READ_CONVERSATION_QUERY = """
+    SELECT text, who, date FROM (
+        SELECT
+            message.text,
+            CASE WHEN message.is_from_me THEN 'Me' ELSE COALESCE(handle.id, 'Them') END as who,
+            message.date
+        FROM message
+        JOIN chat_message_join ON message.ROWID = chat_message_join.message_id
+        JOIN chat ON chat_message_join.chat_id = chat.ROWID
+        LEFT JOIN handle ON message.handle_id = handle.ROWID
+        WHERE chat.chat_identifier = ? AND message.text <> ''
+        ORDER BY message.date DESC
+        LIMIT ?
+    )
+    ORDER BY date ASC
+    """
 
 
 @mcp.tool()
@@ -76,45 +325,24 @@ def read_conversation(chat_identifier: str, limit: int = 30) -> str:
         chat_identifier: The phone number or email of the conversation (e.g., "+15551234567")
         limit: Maximum number of messages to return (default 30)
     """
-    conn = get_messages_db()
-    cursor = conn.cursor()
-
-    query = """
-    SELECT
-        message.text,
-        message.is_from_me,
-        message.date,
-        handle.id as sender
-    FROM message
-    JOIN chat_message_join ON message.ROWID = chat_message_join.message_id
-    JOIN chat ON chat_message_join.chat_id = chat.ROWID
-    LEFT JOIN handle ON message.handle_id = handle.ROWID
-    WHERE chat.chat_identifier = ?
-    ORDER BY message.date DESC
-    LIMIT ?
-    """
-
-    cursor.execute(query, (chat_identifier, limit))
-    rows = cursor.fetchall()
-    conn.close()
+    rows = query_messages_db(READ_CONVERSATION_QUERY, (chat_identifier, limit))
 
     if not rows:
         return f"No messages found for {chat_identifier}."
 
-    output = []
-    for text, is_from_me, date, sender in reversed(rows):
-        if not text:
-            continue
-        who = "Me" if is_from_me else (sender or "Them")
-        # Convert Apple's timestamp (nanoseconds since 2001-01-01)
+    output = io.StringIO()
+    for text, who, date in rows:
+        # Convert Apple's timestamp
         if date:
-            ts = datetime(2001, 1, 1) + __import__('datetime').timedelta(seconds=date / 1e9)
+            ts = APPLE_EPOCH + timedelta(microseconds=date // 1000)
             time_str = ts.strftime("%Y-%m-%d %H:%M")
         else:
             time_str = "Unknown time"
-        output.append(f"[{time_str}] {who}: {text}")
+        if output.tell():
+            output.write("\n")
+        output.write(f"[{time_str}] {who}: {text}")
 
-    return "\n".join(output)
+    return output.getvalue()
 
 
 @mcp.tool()
@@ -128,13 +356,15 @@ def send_message(to: str, message: str) -> str:
     script = f'''
     tell application "Messages"
         set targetService to 1st account whose service type = iMessage
-        set targetBuddy to participant "{to}" of targetService
-        send "{message.replace('"', '\\"')}" to targetBuddy
+        set targetBuddy to participant "{to.translate(APPLESCRIPT_ESCAPES)}" of targetService
+        send "{message.translate(APPLESCRIPT_ESCAPES)}" to targetBuddy
     end tell
     '''
 
+    # Pass the script on stdin rather than as an argument, so long messages are fine
     result = subprocess.run(
-        ["osascript", "-e", script],
+        ["osascript", "-"],
+        input=script,
         capture_output=True,
         text=True
     )
@@ -145,18 +375,7 @@ def send_message(to: str, message: str) -> str:
     return f"Message sent to {to}"
 
 
-@mcp.tool()
-def search_messages(query: str, limit: int = 30) -> str:
-    """Search messages by text content.
-
-    Args:
-        query: Text to search for in messages
-        limit: Maximum number of results (default 30)
-    """
-    conn = get_messages_db()
-    cursor = conn.cursor()
-
-    search_query = """
+SEARCH_QUERY = """
     SELECT
         message.text,
         message.is_from_me,
@@ -171,28 +390,42 @@ def search_messages(query: str, limit: int = 30) -> str:
     LIMIT ?
     """
 
-    cursor.execute(search_query, (f"%{query}%", limit))
-    rows = cursor.fetchall()
-    conn.close()
+
+@mcp.tool()
+def search_messages(query: str, limit: int = 30) -> str:
+    """Search messages by text content.
+
+    Args:
+        query: Text to search for in messages
+        limit: Maximum number of results (default 30)
+    """
+    rows = None
+    # LIKE wildcards in the query have no equivalent in the index
+    if len(query) >= MIN_INDEXED_QUERY and not any(c in query for c in "%_"):
+        rows = search_index(query, limit)
+    if rows is None:
+        rows = query_messages_db(SEARCH_QUERY, (f"%{query}%", limit))
 
     if not rows:
         return f"No messages matching '{query}' found."
 
-    output = []
+    output = io.StringIO()
     for text, is_from_me, date, chat_id, display_name in rows:
         who = "Me" if is_from_me else "Them"
         chat_name = display_name or chat_id
         if date:
-            ts = datetime(2001, 1, 1) + __import__('datetime').timedelta(seconds=date / 1e9)
+            ts = APPLE_EPOCH + timedelta(microseconds=date // 1000)
             time_str = ts.strftime("%Y-%m-%d %H:%M")
         else:
             time_str = "Unknown"
-        output.append(
+        if output.tell():
+            output.write("\n---\n")
+        output.write(
             f"[{time_str}] {chat_name}\n"
             f"{who}: {text}\n"
         )
 
-    return "\n---\n".join(output)
+    return output.getvalue()
 
 
 if __name__ == "__main__":